@@ -2,6 +2,7 @@
 from __future__ import annotations
 
 import logging
+from concurrent.futures import ThreadPoolExecutor
 from ipaddress import ip_address
 from socket import gaierror, gethostbyname
 from typing import Any, Callable
@@ -30,6 +31,7 @@ from .ouimeaux_device.outdoor_plug import OutdoorPlug
 from .ouimeaux_device.switch import Switch
 
 LOG = logging.getLogger(__name__)
+MAX_DISCOVERY_WORKERS = 16
 _uuid_seen = set()  # See _call_once_per_uuid.
 
 
@@ -45,11 +47,23 @@ def _call_once_per_uuid(
 
 def discover_devices(*, debug: bool = False, **kwargs: Any) -> list[Device]:
     """Find WeMo devices on the local network."""
-    devices = (
-        device_from_uuid_and_location(entry.udn, entry.location, debug=debug)
-        for entry in ssdp.scan(**kwargs)
-    )
-    return [d for d in devices if d is not None]
+    entries = ssdp.scan(**kwargs)
+    if not entries:
+        return []
+
+    # Each entry is a different device, so fetching the device descriptions
+    # concurrently does not put any extra load on an individual device.
+    with ThreadPoolExecutor(
+        max_workers=min(MAX_DISCOVERY_WORKERS, len(entries)),
+        thread_name_prefix="WemoDiscovery",
+    ) as executor:
+        devices = executor.map(
+            lambda entry: device_from_uuid_and_location(
+                entry.udn, entry.location, debug=debug
+            ),
+            entries,
+        )
+        return [d for d in devices if d is not None]
 
 
 def device_from_description(
@@ -28,10 +28,15 @@ class Maker(AttributeDevice):
 
     def set_state(self, state: int) -> None:
         """Set the state of this device to on or off."""
-        # The Maker has a momentary mode - so it's not safe to assume
-        # the state is what you just set, so re-read it from the device
         self.basicevent.SetBinaryState(BinaryState=int(state))
-        self.get_state(True)
+        if self._attributes.get("SwitchMode") == 0:
+            # Toggle mode: the switch stays in the state that was just set.
+            self._attributes["Switch"] = int(state)
+            self._state = int(state)
+        else:
+            # The Maker has a momentary mode - so it's not safe to assume
+            # the state is what you just set, so re-read it from the device
+            self.get_state(True)
 
     @property
     def switch_state(self) -> int:
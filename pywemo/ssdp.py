@@ -2,13 +2,14 @@
 from __future__ import annotations
 
 import logging
-import re
-import select
+import selectors
 import socket
+import struct
 import threading
 import time
 import uuid
-from datetime import datetime, timedelta
+from datetime import timedelta
+from typing import Iterator
 from wsgiref.handlers import format_date_time
 
 from .ouimeaux_device.api.long_press import VIRTUAL_DEVICE_UDN
@@ -18,16 +19,29 @@ DISCOVER_TIMEOUT = 5
 
 LOG = logging.getLogger(__name__)
 
-RESPONSE_REGEX = re.compile(r"\n(.*)\: (.*)\r")
-
 MIN_TIME_BETWEEN_SCANS = timedelta(seconds=59)
 
 MULTICAST_GROUP = "239.255.255.250"
 MULTICAST_PORT = 1900
 
+# Receive buffer size requested for the SSDP sockets. A larger buffer avoids
+# dropping replies when many devices respond at once. The kernel may clamp
+# this value (net.core.rmem_max on Linux).
+SSDP_SO_RCVBUF = 1 << 20
+
+# Multicast TTL recommended by the UPnP Device Architecture.
+MULTICAST_TTL = 2
+
+# Maximum number of requesters, and the seconds, for which the
+# DiscoveryResponder reuses the callback address sent in its replies.
+CALLBACK_CACHE_SIZE = 256
+CALLBACK_CACHE_TTL = 60
+
 # Wemo specific urn:
 ST = "urn:Belkin:service:basicevent:1"
 VIRTUAL_DEVICE_USN = f"{VIRTUAL_DEVICE_UDN}::{ST}"
+VIRTUAL_DEVICE_USN_BYTES = VIRTUAL_DEVICE_USN.encode("UTF-8")
+EXPECTED_RESPONSE_PREFIX = b"HTTP/1.1 200"
 MAX_AGE = 86400
 
 SSDP_REPLY = f"""HTTP/1.1 200 OK
@@ -44,6 +58,7 @@ USN: {VIRTUAL_DEVICE_USN}
 
 """  # Newline characters at the the end of SSDP_REPLY are intentional.
 SSDP_REPLY = SSDP_REPLY.replace("\n", "\r\n")
+SSDP_REPLY_BYTES = SSDP_REPLY.encode("UTF-8")
 
 SSDP_NOTIFY = f"""NOTIFY * HTTP/1.1
 HOST: {MULTICAST_GROUP}:{MULTICAST_PORT}
@@ -59,9 +74,11 @@ USN: {VIRTUAL_DEVICE_USN}
 
 """  # Newline characters at the the end of SSDP_NOTIFY are intentional.
 SSDP_NOTIFY = SSDP_NOTIFY.replace("\n", "\r\n")
+SSDP_NOTIFY_BYTES = SSDP_NOTIFY.encode("UTF-8")
 
 EXPECTED_ST_HEADER = ("ST: " + ST).encode("UTF-8")
 EXPECTED_MAN_HEADER = b'MAN: "ssdp:discover"'
+EXPECTED_HEADERS = frozenset((EXPECTED_ST_HEADER, EXPECTED_MAN_HEADER))
 
 
 class UPNPEntry:
@@ -70,13 +87,25 @@ class UPNPEntry:
     def __init__(self, values: dict[str, str]) -> None:
         """Create a UPNPEntry object."""
         self.values = values
-        self._created = datetime.now()
-        self._expires: datetime | None = None
+        self._created = time.monotonic()
+        # Tuple of values that uniquely identify the UPNPEntry instance.
+        self._key = (self.udn, self.location)
+        self._hash = hash(("UPNPEntry", self._key))
 
-        if "cache-control" in self.values:
-            cache_seconds = int(self.values["cache-control"].split("=")[1])
+    @property
+    def expires(self) -> float | None:
+        """Return the time.monotonic() value when the entry expires.
 
-            self._expires = self._created + timedelta(seconds=cache_seconds)
+        The cache-control header is only parsed when this is accessed. None is
+        returned if the header is missing or could not be parsed.
+        """
+        if (cache_control := self.values.get("cache-control")) is None:
+            return None
+        try:
+            cache_seconds = int(cache_control.split("=")[1])
+        except (IndexError, ValueError):
+            return None
+        return self._created + cache_seconds
 
     @property
     def st(self) -> str | None:  # pylint: disable=invalid-name
@@ -100,19 +129,17 @@ class UPNPEntry:
         return usn.split("::")[0]
 
     @classmethod
-    def from_response(cls, response: str) -> UPNPEntry:
+    def from_response(cls, response: bytes | str) -> UPNPEntry:
         """Create a uPnP entry from a response."""
-        return UPNPEntry(
-            {
-                key.lower(): item
-                for key, item in RESPONSE_REGEX.findall(response)
-            }
-        )
-
-    @property
-    def _key(self) -> tuple[str, str | None]:
-        """Tuple of values that uniquely identify the UPNPEntry instance."""
-        return (self.udn, self.location)
+        if isinstance(response, str):
+            response = response.encode("UTF-8")
+        values = {}
+        for line in response.split(b"\r\n")[1:]:  # Skip the status line.
+            key, sep, value = line.partition(b":")
+            if sep:
+                name = key.strip().lower().decode("UTF-8", "replace")
+                values[name] = value.strip().decode("UTF-8", "replace")
+        return UPNPEntry(values)
 
     def __eq__(self, other: object) -> bool:
         """Equality operator."""
@@ -120,7 +147,7 @@ class UPNPEntry:
 
     def __hash__(self) -> int:
         """Generate hash of instance."""
-        return hash(("UPNPEntry", self._key))
+        return self._hash
 
     def __repr__(self) -> str:
         """Return the string representation of the object."""
@@ -145,6 +172,75 @@ def build_ssdp_request(ssdp_st: str, ssdp_mx: int) -> bytes:
     ).encode("ascii")
 
 
+def _set_receive_buffer(sock: socket.socket) -> None:
+    """Request a larger receive buffer, if the platform allows it."""
+    try:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, SSDP_SO_RCVBUF)
+    except OSError:
+        pass
+
+
+def _set_multicast_options(sock: socket.socket, addr: str) -> None:
+    """Send multicast datagrams out of the interface with address addr.
+
+    The options are only a hint. Any that the platform rejects are skipped,
+    and the datagrams are sent with the system default for that option.
+    """
+    options = [
+        (socket.IP_MULTICAST_IF, socket.inet_aton(addr)),
+        # Some platforms (eg. OpenBSD and NetBSD) require a single byte.
+        (socket.IP_MULTICAST_TTL, struct.pack("B", MULTICAST_TTL)),
+    ]
+    for option, value in options:
+        try:
+            sock.setsockopt(socket.IPPROTO_IP, option, value)
+        except OSError:
+            pass
+
+
+def _receive_datagrams(
+    sock: socket.socket, buffer: bytearray
+) -> Iterator[int]:
+    """Receive each datagram queued on a non-blocking socket into buffer.
+
+    Yields the number of bytes received. The buffer is overwritten by the
+    next datagram.
+    """
+    while True:
+        try:
+            yield sock.recv_into(buffer)
+        except BlockingIOError:
+            return
+
+
+def _join_multicast_group(sock: socket.socket) -> None:
+    """Join the SSDP multicast group on all interfaces."""
+    group = socket.inet_aton(MULTICAST_GROUP)
+    for addr in interface_addresses():
+        try:
+            local = socket.inet_aton(addr)
+            sock.setsockopt(
+                socket.IPPROTO_IP, socket.IP_ADD_MEMBERSHIP, group + local
+            )
+        except OSError as err:
+            LOG.error("Failed join multicast group on %s: %s", addr, err)
+
+
+def _is_discovery_request(buffer: bytearray, nbytes: int) -> bool:
+    """Return True if buffer holds an M-SEARCH for the virtual device."""
+    if not buffer.startswith(b"M-SEARCH * HTTP", 0, nbytes):
+        return False
+    # Cheap substring checks reject other M-SEARCH requests before the exact
+    # per-line comparison below.
+    if (
+        buffer.find(EXPECTED_ST_HEADER, 0, nbytes) < 0
+        or buffer.find(EXPECTED_MAN_HEADER, 0, nbytes) < 0
+    ):
+        return False
+    lines = bytes(memoryview(buffer)[:nbytes]).splitlines()
+    return EXPECTED_HEADERS.issubset(lines)
+
+
 def scan(  # pylint: disable=too-many-branches,too-many-locals
     st: str = ST,  # pylint: disable=invalid-name
     timeout: float = DISCOVER_TIMEOUT,
@@ -161,17 +257,27 @@ def scan(  # pylint: disable=too-many-branches,too-many-locals
     ssdp_target = (MULTICAST_GROUP, MULTICAST_PORT)
 
     entries: list[UPNPEntry] = []
-
-    calc_now = datetime.now
+    seen: set[UPNPEntry] = set()
 
     ssdp_request = build_ssdp_request(st, ssdp_mx=1)
+    # Cheap byte-level filter applied before parsing each response.
+    udn_needle = None if match_udn is None else match_udn.encode("UTF-8")
+    # Datagrams are received into one reused buffer. Only the responses that
+    # pass the filters below are copied out of it.
+    buffer = bytearray(1024)
+    view = memoryview(buffer)
     sockets = []
+    selector = selectors.DefaultSelector()
     try:
         for addr in interface_addresses():
             sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
             try:
+                _set_receive_buffer(sock)
+                sock.setblocking(False)
                 sock.bind((addr, 0))
+                _set_multicast_options(sock, addr)
                 sock.sendto(ssdp_request, ssdp_target)
+                selector.register(sock, selectors.EVENT_READ, sock)
                 sockets.append(sock)
             except OSError:
                 pass
@@ -179,49 +285,59 @@ def scan(  # pylint: disable=too-many-branches,too-many-locals
                 if sock not in sockets:
                     sock.close()
 
-        start = calc_now()
+        send_calls = [sock.sendto for sock in sockets]
+        start = time.monotonic()
         while sockets:
-            time_diff = calc_now() - start
-
-            seconds_left = max(timeout - time_diff.seconds, 0)
+            seconds_left = max(timeout - (time.monotonic() - start), 0)
 
-            ready = select.select(sockets, [], [], min(1, seconds_left))[0]
+            ready = selector.select(min(1, seconds_left))
             if not ready:
                 # Only check for timeout when there are no more results. Exit
                 # if the time has expired, or probe again if there is more
                 # time remaining.
                 if seconds_left <= 0:
                     return entries
-                for sock in sockets:
-                    sock.sendto(ssdp_request, ssdp_target)
-
-            for sock in ready:
-                response = sock.recv(1024).decode("UTF-8", "replace")
-
-                entry = UPNPEntry.from_response(response)
-                if entry.usn == VIRTUAL_DEVICE_USN:
-                    continue  # Don't return the virtual device.
-
-                # Search for devices
-                if entry not in entries:
-                    if match_udn is None:
-                        entries.append(entry)
-                    elif match_udn == entry.udn:
-                        entries.append(entry)
-
-                    # Return if we've found the max number of devices
-                    if max_entries and len(entries) == max_entries:
-                        return entries
+                for send in send_calls:
+                    send(ssdp_request, ssdp_target)
+
+            # Drain each ready socket so a burst of replies is handled with
+            # a single selector.select call.
+            for key, _ in ready:
+                for nbytes in _receive_datagrams(key.data, buffer):
+                    if not buffer.startswith(
+                        EXPECTED_RESPONSE_PREFIX, 0, nbytes
+                    ):
+                        continue  # Not a successful M-SEARCH response.
+                    if buffer.find(VIRTUAL_DEVICE_USN_BYTES, 0, nbytes) >= 0:
+                        continue  # Don't return the virtual device.
+                    if (
+                        udn_needle is not None
+                        and buffer.find(udn_needle, 0, nbytes) < 0
+                    ):
+                        continue  # Response is not for the requested device.
+
+                    entry = UPNPEntry.from_response(bytes(view[:nbytes]))
+
+                    # Search for devices
+                    if entry not in seen:
+                        if match_udn is None or match_udn == entry.udn:
+                            seen.add(entry)
+                            entries.append(entry)
+
+                        # Return if we've found the max number of devices
+                        if max_entries and len(entries) == max_entries:
+                            return entries
     except OSError:
         LOG.exception("Socket error while discovering SSDP devices")
     finally:
+        selector.close()
         for sock in sockets:
             sock.close()
 
     return entries
 
 
-class DiscoveryResponder:
+class DiscoveryResponder:  # pylint: disable=too-many-instance-attributes
     """Inform Wemo devices of the pywemo virtual Wemo device.
 
     The DiscoveryResponder informs Wemo devices of the /setup.xml URL for the
@@ -251,84 +367,101 @@ class DiscoveryResponder:
         self._thread_exception: Exception | None = None
         self._notify_enabled = True  # Only ever set to False in tests.
         self._nls_uuid = str(uuid.uuid4())
+        # Socket pair used by stop() to wake the thread from selector.select.
+        self._wakeup: tuple[socket.socket, socket.socket] | None = None
+        # Encoded callback address and its expiry, keyed by requester address.
+        self._callbacks: dict[str, tuple[bytes, float]] = {}
 
     def send_notify(self, nts: str) -> None:
         """Send a UPnP NOTIFY message containing the virtual device URL."""
         ssdp_target = (MULTICAST_GROUP, MULTICAST_PORT)
         for addr in interface_addresses():  # Send on all interfaces.
+            callback = get_callback_address(addr, self.callback_port)
+            if callback is None:
+                continue  # No route from this interface.
             params = {
-                "callback": get_callback_address(addr, self.callback_port),
-                "nls": self._nls_uuid,
-                "nts": nts,
+                b"callback": callback.encode("UTF-8"),
+                b"nls": self._nls_uuid.encode("UTF-8"),
+                b"nts": nts.encode("UTF-8"),
             }
             sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
             try:
                 sock.bind((addr, 0))
-                sock.sendto(
-                    (SSDP_NOTIFY % params).encode("UTF-8"), ssdp_target
-                )
+                _set_multicast_options(sock, addr)
+                sock.sendto(SSDP_NOTIFY_BYTES % params, ssdp_target)
             except OSError:
                 pass
             finally:
                 sock.close()
 
+    def _callback_for(self, host: str) -> bytes | None:
+        """Return the encoded callback address to send in replies to host.
+
+        get_callback_address needs a socket to find the local address, so the
+        result is reused for CALLBACK_CACHE_TTL seconds. The cache is emptied
+        once it holds CALLBACK_CACHE_SIZE hosts. None is returned, and not
+        cached, when there is no route to host.
+        """
+        now = time.monotonic()
+        cached = self._callbacks.get(host)
+        if cached is not None and cached[1] > now:
+            return cached[0]
+        if len(self._callbacks) >= CALLBACK_CACHE_SIZE:
+            self._callbacks.clear()  # Bound memory on very busy networks.
+        callback = get_callback_address(host, self.callback_port)
+        if callback is None:
+            return None
+        encoded = callback.encode("UTF-8")
+        self._callbacks[host] = (encoded, now + CALLBACK_CACHE_TTL)
+        return encoded
+
     def respond_to_discovery(self) -> None:
         """Respond to a WeMo discovery request with the virtual device URL."""
         recv_sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
         send_sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        selector = selectors.DefaultSelector()
         try:
             recv_sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-
-            # Join the multicast group on all interfaces.
-            group = socket.inet_aton(MULTICAST_GROUP)
-            for addr in interface_addresses():
-                try:
-                    local = socket.inet_aton(addr)
-                    recv_sock.setsockopt(
-                        socket.IPPROTO_IP,
-                        socket.IP_ADD_MEMBERSHIP,
-                        group + local,
-                    )
-                except OSError as err:
-                    LOG.error(
-                        "Failed join multicast group on %s: %s", addr, err
-                    )
-
+            _set_receive_buffer(recv_sock)
+            _join_multicast_group(recv_sock)
             recv_sock.bind((MULTICAST_GROUP, MULTICAST_PORT))
+            selector.register(recv_sock, selectors.EVENT_READ)
+            if self._wakeup is not None:
+                selector.register(self._wakeup[0], selectors.EVENT_READ)
+
+            # Reused for every datagram so that unrelated multicast traffic
+            # (NOTIFY messages, other M-SEARCH requests) can be discarded
+            # without allocating a new bytes object.
+            buffer = bytearray(1024)
+            nls = self._nls_uuid.encode("UTF-8")
 
-            next_notify = datetime.min
+            next_notify = time.monotonic()
             while not self._exit.is_set():
-                # Periodically send NOTIFY messages.
-                now = datetime.now()
-                if now > next_notify and self._notify_enabled:
-                    next_notify = now + timedelta(seconds=(MAX_AGE / 2) - 30)
-                    self.send_notify("ssdp:alive")
+                timeout = None
+                if self._notify_enabled:
+                    # Periodically send NOTIFY messages.
+                    now = time.monotonic()
+                    if now >= next_notify:
+                        next_notify = now + (MAX_AGE / 2) - 30
+                        self.send_notify("ssdp:alive")
+                    timeout = next_notify - now
 
                 # Check for new discovery requests.
-                if not select.select([recv_sock], [], [], 1)[0]:
-                    continue  # Timeout, no data. Loop again and check for exit
-                msg, sock_addr = recv_sock.recvfrom(1024)
-                lines = msg.splitlines()
-                if len(lines) < 3 or not lines[0].startswith(
-                    b"M-SEARCH * HTTP"
-                ):
-                    continue
-                if (
-                    EXPECTED_ST_HEADER not in lines
-                    or EXPECTED_MAN_HEADER not in lines
-                ):
+                events = selector.select(timeout)
+                if not any(key.fileobj is recv_sock for key, _ in events):
+                    continue  # Timeout, or woken up by stop().
+                nbytes, sock_addr = recv_sock.recvfrom_into(buffer)
+                if not _is_discovery_request(buffer, nbytes):
                     continue
                 params = {
-                    "callback": get_callback_address(
-                        sock_addr[0], self.callback_port
-                    ),
-                    "date": format_date_time(time.time()),
-                    "nls": self._nls_uuid,
+                    b"callback": self._callback_for(sock_addr[0]),
+                    b"date": format_date_time(time.time()).encode("UTF-8"),
+                    b"nls": nls,
                 }
+                if params[b"callback"] is None:
+                    continue  # No local address to reply from.
                 try:
-                    send_sock.sendto(
-                        (SSDP_REPLY % params).encode("UTF-8"), sock_addr
-                    )
+                    send_sock.sendto(SSDP_REPLY_BYTES % params, sock_addr)
                 except OSError as err:
                     LOG.error(
                         "Failed to send SSDP reply to %r: %s", sock_addr, err
@@ -340,6 +473,7 @@ class DiscoveryResponder:
             self._thread_exception = exp  # Used in the stop() method.
             raise
         finally:
+            selector.close()
             recv_sock.close()
             send_sock.close()
 
@@ -347,6 +481,8 @@ class DiscoveryResponder:
         """Start the server."""
         self._exit.clear()
         self._thread_exception = None
+        self._callbacks.clear()
+        self._wakeup = socket.socketpair()
         self._thread = threading.Thread(
             target=self.respond_to_discovery,
             name="Wemo DiscoveryResponder Thread",
@@ -357,8 +493,14 @@ class DiscoveryResponder:
         """Stop the server."""
         if self._thread:
             self._exit.set()
+            if self._wakeup is not None:
+                self._wakeup[1].send(b"\0")
             self._thread.join()
             self._thread = None
+            if self._wakeup is not None:
+                for sock in self._wakeup:
+                    sock.close()
+                self._wakeup = None
             # Improve visibility of any exceptions that occurred on the thread.
             if self._thread_exception is not None:
                 # pylint: disable=raising-bad-type
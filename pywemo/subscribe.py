@@ -41,7 +41,9 @@ import secrets
 import threading
 import time
 import warnings
+import weakref
 from collections.abc import Iterable, MutableMapping
+from concurrent.futures import Future, ThreadPoolExecutor
 from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 from typing import Any, Callable
 
@@ -66,6 +68,18 @@ NS = "{urn:schemas-upnp-org:event-1-0}"
 RESPONSE_SUCCESS = "<html><body><h1>200 OK</h1></body></html>"
 RESPONSE_NOT_FOUND = "<html><body><h1>404 Not Found</h1></body></html>"
 SUBSCRIPTION_RETRY = 60
+MAX_RESUBSCRIBE_WORKERS = 8
+REPEATED_EVENT_WINDOW = 0.1
+TIMEOUT_PREFIX = "Second-"
+_TIMEOUT_PREFIX_LEN = len(TIMEOUT_PREFIX)
+
+# lxml guards a parser with a lock, so a single instance can be shared by all
+# of the request handler threads. Concurrent parses are serialized; NOTIFY
+# bodies are small, so this costs less than building a parser per request.
+_XML_PARSER = et.XMLParser(resolve_entities=False)
+
+# ElementPath to the child elements of each <e:property> in a NOTIFY body.
+_PROPERTY_CHILDREN = f"./{NS}property/*"
 
 VIRTUAL_SETUP_XML = f"""<?xml version="1.0"?>
 <root xmlns="urn:Belkin:device-1-0">
@@ -132,8 +146,18 @@ ERROR_SOAP_ACTION_RESPONSE = """<?xml version='1.0' encoding='UTF-8'?>
 </s:Body>
 </s:Envelope>"""
 
+# Encoded once; the handler responses never change.
+_RESPONSE_SUCCESS = RESPONSE_SUCCESS.encode("UTF-8")
+_RESPONSE_NOT_FOUND = RESPONSE_NOT_FOUND.encode("UTF-8")
+_VIRTUAL_SETUP_XML = VIRTUAL_SETUP_XML.encode("UTF-8")
+_SOAP_ACTION_RESPONSE = {
+    action: response.encode("UTF-8")
+    for action, response in SOAP_ACTION_RESPONSE.items()
+}
+_ERROR_SOAP_ACTION_RESPONSE = ERROR_SOAP_ACTION_RESPONSE.encode("UTF-8")
+
 
-class Subscription:
+class Subscription:  # pylint: disable=too-many-instance-attributes
     """Subscription to a single UPnP service endpoint."""
 
     scheduler_event: sched.Event | None = None
@@ -184,6 +208,9 @@ class Subscription:
         self.callback_port = callback_port
         self.service_name = service_name
         self.path = f"/sub/{service_name}/{secrets.token_urlsafe(24)}"
+        self._last_events: dict[str, tuple[float, str]] = {}
+        # Serializes maintain() and cancel(), which run on different threads.
+        self._lock = threading.Lock()
 
     def __repr__(self) -> str:
         """Return a string representation of the Subscription."""
@@ -198,6 +225,11 @@ class Subscription:
         Raises:
             requests.RequestException on error.
         """
+        with self._lock:
+            return self._maintain_locked()
+
+    def _maintain_locked(self) -> int:
+        """Start/renew the UPnP subscription while holding `self._lock`."""
         try:
             response = self._subscribe()
             if response.status_code == 412:  # Precondition Failed.
@@ -229,13 +261,30 @@ class Subscription:
 
     def cancel(self) -> None:
         """Cancel a subscription."""
-        if self.expiration_time > time.time():
-            try:
-                self._unsubscribe()
-            except requests.RequestException:
-                pass
+        with self._lock:
+            if self.expiration_time > time.time():
+                try:
+                    self._unsubscribe()
+                except requests.RequestException:
+                    pass
 
-        self._reset_subscription()
+            self._reset_subscription()
+
+    def is_repeated_event(self, type_: str, value: str) -> bool:
+        """Return True if the event repeats the previous event of its type.
+
+        Devices sometimes send bursts of identical notifications. An event is
+        considered a repeat when its value matches the previous event of the
+        same type and it arrived within REPEATED_EVENT_WINDOW seconds.
+        """
+        now = time.monotonic()
+        previous = self._last_events.get(type_)
+        self._last_events[type_] = (now, value)
+        return (
+            previous is not None
+            and previous[1] == value
+            and now - previous[0] < REPEATED_EVENT_WINDOW
+        )
 
     def _subscribe(self) -> requests.Response:
         """Start/renew a subscription with a UPnP SUBSCRIBE request.
@@ -284,10 +333,9 @@ class Subscription:
         """
         self.subscription_id = headers.get("SID", self.subscription_id)
         if timeout_header := headers.get("TIMEOUT", None):
-            timeout = min(
-                int(timeout_header.replace("Second-", "")),
-                self.default_timeout_seconds,
-            )
+            if timeout_header.startswith(TIMEOUT_PREFIX):
+                timeout_header = timeout_header[_TIMEOUT_PREFIX_LEN:]
+            timeout = min(int(timeout_header), self.default_timeout_seconds)
         else:
             timeout = self.default_timeout_seconds
         self.expiration_time = timeout + time.time()
@@ -346,9 +394,11 @@ def _start_server(port: int | None) -> HTTPServer:
 
 
 def _cancel_events(
-    scheduler: sched.scheduler, subscriptions: Iterable[Subscription]
+    scheduler: sched.scheduler,
+    subscriptions: Iterable[Subscription],
+    cancel: Callable[[Subscription], None],
 ) -> None:
-    """Cancel pending scheduler events."""
+    """Cancel pending scheduler events and schedule cancel(subscription)."""
     for subscription in subscriptions:
         try:
             if subscription.scheduler_event is not None:
@@ -358,12 +408,20 @@ def _cancel_events(
             # concurrently.  Safe to ignore
             pass
         if subscription.scheduler_active:
-            scheduler.enter(0, 0, subscription.cancel)
+            scheduler.enter(0, 0, cancel, argument=(subscription,))
         # Prevent the subscription from being scheduled again.
         subscription.scheduler_active = False
         subscription.scheduler_event = None
 
 
+def _run_locked(
+    lock: threading.Lock, func: Callable[..., None], *args: Any
+) -> None:
+    """Call func(*args) while holding lock."""
+    with lock:
+        func(*args)
+
+
 class RequestHandler(BaseHTTPRequestHandler):
     """Handles subscription responses and long press actions from devices.
 
@@ -413,6 +471,9 @@ class RequestHandler(BaseHTTPRequestHandler):
     timeout = 10
     """Do not wait for more than 10 seconds for any request to complete."""
 
+    wbufsize = -1
+    """Buffer writes so that headers and body go out in a single send."""
+
     server: HTTPServer
     server_version = f"{BaseHTTPRequestHandler.server_version} UPnP/1.0"
 
@@ -437,25 +498,24 @@ class RequestHandler(BaseHTTPRequestHandler):
             )
         else:
             doc = self._get_xml_from_http_body()
-            for propnode in doc.findall(f"./{NS}property"):
-                for property_ in list(propnode):
-                    outer.event(
-                        subscription.device,
-                        property_.tag,
-                        property_.text or "",
-                        path=self.path,
-                    )
+            for property_ in doc.iterfind(_PROPERTY_CHILDREN):
+                outer.event(
+                    subscription.device,
+                    property_.tag,
+                    property_.text or "",
+                    path=self.path,
+                )
 
-        self._send_response(200, RESPONSE_SUCCESS)
+        self._send_response(200, _RESPONSE_SUCCESS)
 
     def do_GET(self) -> None:  # pylint: disable=invalid-name
         """Handle GET requests for a Virtual WeMo device."""
         if self.path.endswith("/setup.xml"):
             self._send_response(
-                200, VIRTUAL_SETUP_XML, content_type="text/xml"
+                200, _VIRTUAL_SETUP_XML, content_type="text/xml"
             )
         else:
-            self._send_response(404, RESPONSE_NOT_FOUND)
+            self._send_response(404, _RESPONSE_NOT_FOUND)
 
     def do_POST(self) -> None:  # pylint: disable=invalid-name
         """Handle POST requests for a Virtual WeMo device."""
@@ -476,14 +536,14 @@ class RequestHandler(BaseHTTPRequestHandler):
                     "Received event for unregistered device %s", sender_ip
                 )
             action = self.headers.get("SOAPACTION", "")
-            response = SOAP_ACTION_RESPONSE.get(
-                action, ERROR_SOAP_ACTION_RESPONSE
+            response = _SOAP_ACTION_RESPONSE.get(
+                action, _ERROR_SOAP_ACTION_RESPONSE
             )
             self._send_response(
                 200, response, content_type='text/xml; charset="utf-8"'
             )
         else:
-            self._send_response(404, RESPONSE_NOT_FOUND)
+            self._send_response(404, _RESPONSE_NOT_FOUND)
 
     def do_SUBSCRIBE(self) -> None:  # pylint: disable=invalid-name
         """Handle SUBSCRIBE requests for a Virtual WeMo device."""
@@ -498,7 +558,7 @@ class RequestHandler(BaseHTTPRequestHandler):
             self.send_header("Connection", "close")
             self.end_headers()
         else:
-            self._send_response(404, RESPONSE_NOT_FOUND)
+            self._send_response(404, _RESPONSE_NOT_FOUND)
 
     def do_UNSUBSCRIBE(self) -> None:  # pylint: disable=invalid-name
         """Handle UNSUBSCRIBE requests for a Virtual WeMo device."""
@@ -508,10 +568,10 @@ class RequestHandler(BaseHTTPRequestHandler):
             self.send_header("Connection", "close")
             self.end_headers()
         else:
-            self._send_response(404, RESPONSE_NOT_FOUND)
+            self._send_response(404, _RESPONSE_NOT_FOUND)
 
     def _send_response(
-        self, code: int, body: str, *, content_type: str = "text/html"
+        self, code: int, body: bytes, *, content_type: str = "text/html"
     ) -> None:
         self.send_response(code)
         self.send_header("Content-Type", content_type)
@@ -519,7 +579,7 @@ class RequestHandler(BaseHTTPRequestHandler):
         self.send_header("Connection", "close")
         self.end_headers()
         if body:
-            self.wfile.write(body.encode("UTF-8"))
+            self.wfile.write(body)
 
     def _get_xml_from_http_body(self) -> et._Element:
         """Build the element tree root from the body of the http request."""
@@ -527,7 +587,7 @@ class RequestHandler(BaseHTTPRequestHandler):
         data = self.rfile.read(content_len)
         # trim garbage from end, if any
         data = data.strip()
-        return et.fromstring(data, parser=et.XMLParser(resolve_entities=False))
+        return et.fromstring(data, parser=_XML_PARSER)
 
     # pylint: disable=redefined-builtin
     def log_message(self, format: str, *args: Any) -> None:
@@ -569,6 +629,14 @@ class SubscriptionRegistry:  # pylint: disable=too-many-instance-attributes
 
         self._sched = sched.scheduler(time.time, sleep)
 
+        self._resubscribe_pool: ThreadPoolExecutor | None = None
+        self._resubscribe_futures: set[Future[None]] = set()
+        # Serializes the pool jobs for each device. WeMo devices only have a
+        # few HTTP worker threads, so only different devices run in parallel.
+        self._device_locks: weakref.WeakKeyDictionary[
+            Device, threading.Lock
+        ] = weakref.WeakKeyDictionary()
+
         self._http_thread: threading.Thread | None = None
         self._httpd: HTTPServer | None = None
         self._requested_port: int | None = requested_port
@@ -608,17 +676,59 @@ class SubscriptionRegistry:  # pylint: disable=too-many-instance-attributes
             # Remove any events, callbacks, and the device itself
             self._callbacks.pop(device, None)
             subscriptions = self._subscriptions.pop(device, [])
-            _cancel_events(self._sched, subscriptions)
+            _cancel_events(self._sched, subscriptions, self._cancel)
             for subscription in subscriptions:
                 del self._subscription_paths[subscription.path]
             self._event_thread_cond.notify()
 
     def _resubscribe(self, subscription: Subscription, retry: int = 0) -> None:
+        """Renew a subscription on the resubscribe thread pool.
+
+        Renewals run off of the event thread so that a slow or unreachable
+        device does not delay the renewals for other devices.
+        """
+        with self._event_thread_cond:
+            if self._resubscribe_pool is None:
+                return  # The registry is stopping.
+            self._submit(subscription, self._maintain, subscription, retry)
+
+    def _cancel(self, subscription: Subscription) -> None:
+        """Cancel a subscription on the resubscribe thread pool.
+
+        The UNSUBSCRIBE waits for any renewal in flight for the device, so it
+        is sent from the pool to keep the event thread free.
+        """
+        with self._event_thread_cond:
+            if self._resubscribe_pool is not None:
+                self._submit(subscription, subscription.cancel)
+                return
+        # The registry is stopping and the pool has already finished.
+        subscription.cancel()
+
+    def _submit(
+        self, subscription: Subscription, func: Callable[..., None], *args: Any
+    ) -> None:
+        """Run func(*args) on the pool, one job at a time per device.
+
+        It is expected that the caller will hold the `_event_thread_cond` lock
+        before calling this method.
+        """
+        assert self._resubscribe_pool
+        lock = self._device_locks.setdefault(
+            subscription.device, threading.Lock()
+        )
+        future = self._resubscribe_pool.submit(_run_locked, lock, func, *args)
+        self._resubscribe_futures.add(future)
+        future.add_done_callback(self._resubscribe_done)
+
+    def _resubscribe_done(self, future: Future[None]) -> None:
+        with self._event_thread_cond:
+            self._resubscribe_futures.discard(future)
+
+    def _maintain(self, subscription: Subscription, retry: int) -> None:
         LOG.info("Resubscribe for %r", subscription)
         try:
             timeout = subscription.maintain()
-            with self._event_thread_cond:
-                self._schedule(int(timeout * 0.75), subscription)
         except requests.RequestException as exc:
             LOG.warning(
                 "Resubscribe error for %r (%s), will retry in %ss",
@@ -633,6 +743,18 @@ class SubscriptionRegistry:  # pylint: disable=too-many-instance-attributes
                 subscription.device.reconnect_with_device()
             with self._event_thread_cond:
                 self._schedule(SUBSCRIPTION_RETRY, subscription, retry=retry)
+                self._event_thread_cond.notify()
+            return
+
+        with self._event_thread_cond:
+            if subscription.scheduler_active:
+                self._schedule(int(timeout * 0.75), subscription)
+                self._event_thread_cond.notify()
+                return
+        # The device was unregistered while the renewal was in flight. The
+        # cancel from unregister() may have run before the subscription was
+        # established, so make sure the device is unsubscribed.
+        subscription.cancel()
 
     def _schedule(
         self, delay: int, subscription: Subscription, **kwargs: Any
@@ -674,6 +796,8 @@ class SubscriptionRegistry:  # pylint: disable=too-many-instance-attributes
                 subscription := self._subscription_paths.get(path)
             ) is not None:
                 subscription.event_received = True
+                if subscription.is_repeated_event(type_, value):
+                    return
             else:
                 LOG.warning(
                     "Received unexpected subscription path (%s) for device %s",
@@ -724,6 +848,11 @@ class SubscriptionRegistry:  # pylint: disable=too-many-instance-attributes
         self._http_thread.daemon = True
         self._http_thread.start()
 
+        self._resubscribe_pool = ThreadPoolExecutor(
+            max_workers=MAX_RESUBSCRIBE_WORKERS,
+            thread_name_prefix="WemoResubscribe",
+        )
+
         self._event_thread = threading.Thread(
             target=self._run_event_loop, name="Wemo Events Thread"
         )
@@ -735,12 +864,23 @@ class SubscriptionRegistry:  # pylint: disable=too-many-instance-attributes
         assert self._httpd
         self._httpd.shutdown()
 
+        # Drop the renewals that have not started yet, then let the in-flight
+        # renewals finish before the subscriptions are canceled, so that no
+        # renewal can complete after its UNSUBSCRIBE was sent.
+        with self._event_thread_cond:
+            pool, self._resubscribe_pool = self._resubscribe_pool, None
+            futures = list(self._resubscribe_futures)
+        assert pool
+        for future in futures:
+            future.cancel()
+        pool.shutdown(wait=True)
+
         with self._event_thread_cond:
             self._exiting = True
 
             # Remove any pending events
             for device_subscriptions in self._subscriptions.values():
-                _cancel_events(self._sched, device_subscriptions)
+                _cancel_events(self._sched, device_subscriptions, self._cancel)
 
             # Wake up event thread if its sleeping
             self._event_thread_cond.notify()
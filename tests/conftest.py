@@ -88,7 +88,11 @@ def subscription_registry():
 
     server = mock.create_autospec(HTTPServer, instance=True)
     server.server_address = ("localhost", 8989)
-    with mock.patch("pywemo.subscribe._start_server", return_value=server):
+    # VCR cassettes cannot be played back from concurrent threads, so run
+    # renewals one at a time.
+    with mock.patch(
+        "pywemo.subscribe._start_server", return_value=server
+    ), mock.patch("pywemo.subscribe.MAX_RESUBSCRIBE_WORKERS", 1):
         registry.start()
         yield registry
 
@@ -1,5 +1,7 @@
 """Integration tests for WeMo Switch devices."""
 
+from unittest.mock import patch
+
 import pytest
 
 from pywemo import Maker
@@ -18,6 +20,20 @@ class Test_Maker:
         maker.off()
         assert maker.get_state(force_update=True) == 0
 
+    def test_turn_on_toggle_mode(self, maker):
+        maker._attributes["SwitchMode"] = 0
+        with patch.object(
+            maker.basicevent, "SetBinaryState"
+        ) as set_binary_state, patch.object(
+            maker.deviceevent, "GetAttributes"
+        ) as get_attributes:
+            maker.on()
+
+        set_binary_state.assert_called_once_with(BinaryState=1)
+        get_attributes.assert_not_called()
+        assert maker.switch_state == 1
+        assert maker.get_state() == 1
+
     def test_maker_params(self, maker):
         assert maker.switch_state == 0
         assert maker.sensor_state == 1
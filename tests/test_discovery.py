@@ -47,6 +47,23 @@ def test_discover_devices(udn, wemo_class):
     assert devices == [mock_device]
 
 
+def test_discover_devices_preserves_order():
+    entries = []
+    for serial in range(5):
+        mock_entry = mock.create_autospec(ssdp.UPNPEntry)
+        mock_entry.udn = f"uuid:Socket-1_0-{serial}"
+        mock_entry.location = f"http://192.168.1.{serial}:49153/setup.xml"
+        entries.append(mock_entry)
+
+    with mock.patch("pywemo.discovery.ssdp") as mock_ssdp, mock.patch(
+        "pywemo.discovery.Switch", side_effect=lambda location: location
+    ):
+        mock_ssdp.scan.return_value = entries
+        devices = discovery.discover_devices()
+
+    assert devices == [entry.location for entry in entries]
+
+
 def test_discover_devices_empty():
     mock_entry = mock.create_autospec(ssdp.UPNPEntry)
     mock_entry.udn = "no matches"
@@ -1,6 +1,7 @@
 """Tests for SSDP and discovery."""
 
 import queue
+import selectors
 import socket
 import unittest.mock as mock
 
@@ -40,41 +41,46 @@ def mock_socket():
 
 
 @pytest.fixture()
-def mock_select():
-    """Queue for delivering return values from select.select.
+def mock_selector():
+    """Queue for delivering return values from DefaultSelector.select.
 
-    This will cause select.select to block until an item is put into the queue.
-    The return value from the mock select.select call will be the value that
-    was put into the queue.
+    This will cause DefaultSelector.select to block until an item is put into
+    the queue. Put a tuple containing a list of ready sockets into the queue to
+    unblock the select call.
     """
     return_queue = queue.Queue()
 
     def do_select(*_):
-        return return_queue.get()
+        return [
+            (selectors.SelectorKey(sock, 0, selectors.EVENT_READ, sock), 1)
+            for sock in return_queue.get()[0]
+        ]
 
-    with mock.patch("select.select", side_effect=do_select):
+    selector = mock.create_autospec(selectors.BaseSelector, instance=True)
+    selector.select.side_effect = do_select
+    with mock.patch("selectors.DefaultSelector", return_value=selector):
         yield return_queue
 
 
 @pytest.fixture()
 def discovery_responder(
-    mock_select,
+    mock_selector,
     mock_socket,
     mock_interface_addresses,
     mock_get_callback_address,
 ):
     """Fixture for DiscoveryResponder instance.
 
-    Returns a callable(msg, addr). When called, (msg, addr) will be the
-    return value from the mock sock.recvfrom. If it is expected that mock
-    sock.sendto is called, the arguments to that mock will be returned from the
-    callable. Example:
+    Returns a callable(msg, addr). When called, msg will be written into the
+    buffer passed to the mock sock.recvfrom_into, and addr will be returned
+    from it. If it is expected that mock sock.sendto is called, the arguments
+    to that mock will be returned from the callable. Example:
 
     sendto_msg, sendto_addr = discovery_responder(recvfrom_msg, recvfrom_addr)
 
     Within the DiscoveryResponder instance, the mock recvfrom/sendto will map
     to the values from the example callable above:
-        (recvfrom_msg, recvfrom_addr) = sock.recvfrom(1024)
+        (len(recvfrom_msg), recvfrom_addr) = sock.recvfrom_into(buffer)
         sock.sendto(sendto_msg, sendto_addr)
     """
     sendto_count = 0
@@ -94,27 +100,35 @@ def discovery_responder(
                 send_queue.put((msg, addr))
 
             mock_socket.sendto.side_effect = sendto
-        mock_socket.recvfrom.return_value = (req.encode("UTF-8"), source)
-        # Unblock the select.select call with a socket, indicating data
+
+        def recvfrom_into(buffer):
+            data = req.encode("UTF-8")
+            buffer[: len(data)] = data
+            return len(data), source
+
+        mock_socket.recvfrom_into.side_effect = recvfrom_into
+        # Unblock the selector.select call with a socket, indicating data
         # is ready.
         with mock.patch(
             "pywemo.ssdp.format_date_time", return_value=MOCK_DATE
         ):
-            mock_select.put(([mock_socket],))
+            mock_selector.put(([mock_socket],))
             if expect_sendto:
                 return send_queue.get()
 
     resp = ssdp.DiscoveryResponder(callback_port=MOCK_CALLBACK_PORT)
     resp._notify_enabled = False
     resp._nls_uuid = "UUID"
-    resp.start()
+    wakeup = (mock.MagicMock(), mock.MagicMock())
+    with mock.patch("socket.socketpair", return_value=wakeup):
+        resp.start()
     try:
         yield do_once
     finally:
         # Signal that the thread should exit, and unblock
-        # the select.select call
+        # the selector.select call
         resp._exit.set()
-        mock_select.put(([],))
+        mock_selector.put(([],))
 
         # Stop the discovery responder
         resp.stop()
@@ -122,6 +136,11 @@ def discovery_responder(
         # Make sure the expected number of calls were made to sock.sendto.
         assert mock_socket.sendto.call_count == sendto_count
 
+        # stop() wakes the thread and closes the socket pair.
+        wakeup[1].send.assert_called_once()
+        wakeup[0].close.assert_called_once()
+        wakeup[1].close.assert_called_once()
+
 
 def test_discovery_responder_notify(
     mock_socket, mock_interface_addresses, mock_get_callback_address
@@ -139,6 +158,15 @@ def test_discovery_responder_notify(
     )
 
 
+def test_discovery_responder_notify_skips_missing_callback(
+    mock_socket, mock_interface_addresses, mock_get_callback_address
+):
+    ssdp.get_callback_address.return_value = None
+    resp = ssdp.DiscoveryResponder(callback_port=MOCK_CALLBACK_PORT)
+    resp.send_notify("ssdp:alive")
+    mock_socket.sendto.assert_not_called()
+
+
 def test_discovery_responder_responds_to_wemo(discovery_responder):
     """The DiscoveryResponder responds to WeMo M-SEARCH messages."""
     from_addr = ("1.2.3.4", 54321)
@@ -163,6 +191,33 @@ HOST: 239.255.255.250:1900
     assert resp_to_addr == from_addr
 
 
+def test_discovery_responder_caches_callback_address(
+    discovery_responder, mock_get_callback_address
+):
+    """The callback address is looked up once per requester."""
+    test_discovery_responder_responds_to_wemo(discovery_responder)
+    test_discovery_responder_responds_to_wemo(discovery_responder)
+    assert ssdp.get_callback_address.call_count == 1
+
+
+def test_discovery_responder_does_not_cache_failed_lookup(
+    discovery_responder,
+):
+    """A failed callback address lookup is retried on the next request."""
+    ssdp.get_callback_address.side_effect = [None, MOCK_CALLBACK_ADDRESS]
+    from_addr = ("1.2.3.4", 54321)
+    msg = """M-SEARCH * HTTP/1.1
+ST: urn:Belkin:service:basicevent:1
+MX: 1
+MAN: "ssdp:discover"
+HOST: 239.255.255.250:1900
+
+"""
+    discovery_responder(msg, from_addr, expect_sendto=False)
+    test_discovery_responder_responds_to_wemo(discovery_responder)
+    assert ssdp.get_callback_address.call_count == 2
+
+
 def test_discovery_responder_ignores_notify(discovery_responder):
     """The DiscoveryResponder does not reply to NOTIFY messages."""
     from_addr = ("1.2.3.4", 54321)
@@ -195,6 +250,25 @@ HOST: 239.255.255.250:1900
     discovery_responder(msg, from_addr, expect_sendto=False)
 
 
+def test_discovery_responder_ignores_other_st_prefix(discovery_responder):
+    """The ST header must match exactly, not just as a prefix."""
+    from_addr = ("1.2.3.4", 54321)
+    msg = """M-SEARCH * HTTP/1.1
+ST: urn:Belkin:service:basicevent:10
+MX: 1
+MAN: "ssdp:discover"
+HOST: 239.255.255.250:1900
+
+"""
+    discovery_responder(msg, from_addr, expect_sendto=False)
+
+
+def test_discovery_responder_ignores_truncated_request(discovery_responder):
+    """Stale bytes left in the receive buffer are not used."""
+    test_discovery_responder_responds_to_wemo(discovery_responder)
+    discovery_responder("M-SEARCH", ("1.2.3.4", 54321), expect_sendto=False)
+
+
 def test_discovery_responder_ignores_sendto_exception(discovery_responder):
     """The DiscoveryResponder does not fail if sendto fails."""
     from_addr = ("1.2.3.4", 54321)
@@ -239,6 +313,20 @@ class TestScan:
         ]
     ).encode()
 
+    @staticmethod
+    def _recv_into(*responses):
+        """Return a side_effect for sock.recv_into delivering responses."""
+        responses = list(responses)
+
+        def recv_into(buffer):
+            response = responses.pop(0)
+            if isinstance(response, bytes):
+                buffer[: len(response)] = response
+                return len(response)
+            raise response
+
+        return recv_into
+
     @pytest.mark.parametrize(
         "kwargs,expected_count",
         [
@@ -252,19 +340,73 @@ class TestScan:
         self,
         mock_interface_addresses,
         mock_socket,
-        mock_select,
+        mock_selector,
         kwargs,
         expected_count,
     ):
-        mock_socket.recv.side_effect = [self._R1, self._R1, self._R2]
-        mock_select.put(([mock_socket],))  # _R1.
-        mock_select.put(([mock_socket],))  # _R1 is received twice.
-        mock_select.put(([mock_socket],))  # _R2.
-        mock_select.put(([],))  # Exit.
+        mock_socket.recv_into.side_effect = self._recv_into(
+            self._R1,
+            BlockingIOError,
+            self._R1,
+            self._R2,
+            BlockingIOError,
+        )
+        mock_selector.put(([mock_socket],))  # _R1.
+        mock_selector.put(([mock_socket],))  # _R1 again, then _R2.
+        mock_selector.put(([],))  # Exit.
 
         entries = ssdp.scan(st=ssdp.ST, timeout=0, **kwargs)
         assert len(entries) == expected_count
 
+    def test_scan_ignores_unexpected_responses(
+        self, mock_interface_addresses, mock_socket, mock_selector
+    ):
+        virtual = self._R1.replace(
+            b"uuid:Socket-1_0-SERIAL", ssdp.VIRTUAL_DEVICE_UDN.encode()
+        )
+        not_ok = self._R1.replace(b"200 OK", b"404 Not Found")
+        mock_socket.recv_into.side_effect = self._recv_into(
+            self._R2, virtual, not_ok, BlockingIOError
+        )
+        mock_selector.put(([mock_socket],))
+        mock_selector.put(([],))  # Exit.
+
+        entries = ssdp.scan(st=ssdp.ST, timeout=0)
+        assert [entry.udn for entry in entries] == ["uuid:Socket-1_0-SERIAL2"]
+
+    @pytest.mark.parametrize(
+        "level,option",
+        [
+            ("IPPROTO_IP", "IP_MULTICAST_IF"),
+            ("IPPROTO_IP", "IP_MULTICAST_TTL"),
+            ("SOL_SOCKET", "SO_RCVBUF"),
+        ],
+    )
+    def test_scan_ignores_socket_option_errors(
+        self,
+        mock_interface_addresses,
+        mock_socket,
+        mock_selector,
+        level,
+        option,
+    ):
+        def setsockopt(*args):
+            if args[:2] == (getattr(socket, level), getattr(socket, option)):
+                raise OSError("Protocol not available")
+
+        mock_socket.setsockopt.side_effect = setsockopt
+        mock_socket.recv_into.side_effect = self._recv_into(
+            self._R1, BlockingIOError
+        )
+        mock_selector.put(([mock_socket],))
+        mock_selector.put(([],))  # Exit.
+
+        entries = ssdp.scan(st=ssdp.ST, timeout=0)
+        assert [entry.udn for entry in entries] == ["uuid:Socket-1_0-SERIAL"]
+        mock_socket.setsockopt.assert_any_call(
+            socket.IPPROTO_IP, socket.IP_MULTICAST_TTL, b"\x02"
+        )
+
 
 class TestUPNPEntry:
     """Tests for the UPNPEntry class."""
@@ -289,3 +431,17 @@ class TestUPNPEntry:
 
         items = set((r1, r2, r1_2))
         assert len(items) == 2
+
+    def test_from_response_bytes(self):
+        r1 = ssdp.UPNPEntry.from_response(TestScan._R1)
+        assert r1.values == ssdp.UPNPEntry.from_response(self._R1).values
+        assert r1.location == "http://192.168.1.100:49158/setup.xml"
+        assert r1.values["cache-control"] == "max-age=1800"
+
+    def test_expires(self):
+        with mock.patch("time.monotonic", return_value=100.0):
+            r1 = ssdp.UPNPEntry.from_response(self._R1)
+        assert r1.expires == 1900.0
+
+        assert ssdp.UPNPEntry({}).expires is None
+        assert ssdp.UPNPEntry({"cache-control": "no-cache"}).expires is None
@@ -121,6 +121,38 @@ class Test_RequestHandler:
             path="/path",
         )
 
+    def test_NOTIFY_multiple_properties(
+        self, outer, server_address, server_url, mock_light_switch
+    ):
+        """NOTIFY calls the event callback for each property."""
+        mock_light_switch.host = server_address
+        subscription = mock.create_autospec(
+            subscribe.Subscription, instance=True
+        )
+        subscription.device = mock_light_switch
+        outer._subscription_paths["/path"] = subscription
+        response = requests.request(
+            "NOTIFY",
+            f"{server_url}/path",
+            data="""<e:propertyset xmlns:e="urn:schemas-upnp-org:event-1-0">
+<e:property>
+<BinaryState>1</BinaryState>
+</e:property>
+<e:property>
+<InsightParams>1|2|3</InsightParams>
+<Empty/>
+</e:property>
+</e:propertyset>""",
+        )
+        assert response.status_code == 200
+        assert outer.event.call_args_list == [
+            mock.call(mock_light_switch, "BinaryState", "1", path="/path"),
+            mock.call(
+                mock_light_switch, "InsightParams", "1|2|3", path="/path"
+            ),
+            mock.call(mock_light_switch, "Empty", "", path="/path"),
+        ]
+
     def test_GET_setup_xml(self, server_url):
         """GET request for /setup.xml returns the VIRTUAL_SETUP_XML."""
         xml = requests.get(f"{server_url}/setup.xml")
@@ -389,6 +421,23 @@ class Test_Subscription:
             time.time() + 200, abs=2
         )
 
+        subscription._update_subscription({"TIMEOUT": "100"})
+        assert subscription.expiration_time == pytest.approx(
+            time.time() + 100, abs=2
+        )
+
+    def test_is_repeated_event(self, subscription):
+        with mock.patch("time.monotonic", return_value=100.0) as monotonic:
+            assert subscription.is_repeated_event("BinaryState", "1") is False
+            assert subscription.is_repeated_event("BinaryState", "1") is True
+            assert subscription.is_repeated_event("BinaryState", "0") is False
+            assert (
+                subscription.is_repeated_event("InsightParams", "0") is False
+            )
+
+            monotonic.return_value += 1.0
+            assert subscription.is_repeated_event("BinaryState", "0") is False
+
 
 class Test_SubscriptionRegistry:
     """Test the SubscriptionRegistry."""
@@ -399,6 +448,16 @@ class Test_SubscriptionRegistry:
         ready = threading.Event()
         subscription_registry._sched.enter(0, 100, ready.set)
         ready.wait()
+        self._wait_for_resubscribe(subscription_registry)
+
+    def _wait_for_resubscribe(self, subscription_registry):
+        # Occupy every worker in the resubscribe pool. Once they are all
+        # busy, any previously submitted renewals have finished.
+        workers = subscribe.MAX_RESUBSCRIBE_WORKERS
+        barrier = threading.Barrier(workers)
+        pool = subscription_registry._resubscribe_pool
+        for future in [pool.submit(barrier.wait) for _ in range(workers)]:
+            future.result()
 
     @pytest.mark.vcr()
     def test_register_unregister(self, device, subscription_registry):
@@ -433,6 +492,69 @@ class Test_SubscriptionRegistry:
 
         assert len(subscription_registry._sched.queue) == 0
 
+    def test_repeated_event_not_dispatched(
+        self, device, subscription_registry
+    ):
+        """Identical back-to-back notifications invoke callbacks once."""
+        subscription = subscribe.Subscription(device, 8989, "basicevent")
+        subscription_registry._subscription_paths[
+            subscription.path
+        ] = subscription
+        callback = mock.Mock()
+        subscription_registry.on(device, None, callback)
+
+        for _ in range(2):
+            subscription_registry.event(
+                device, "BinaryState", "1", path=subscription.path
+            )
+        callback.assert_called_once_with(device, "BinaryState", "1")
+        assert subscription.event_received is True
+
+        subscription_registry.event(device, "BinaryState", "1")
+        assert callback.call_count == 2
+
+    @mock.patch("requests.request")
+    def test_unregister_during_renewal(
+        self, mock_request, device, subscription_registry
+    ):
+        """A renewal in flight during unregister is still unsubscribed."""
+        in_flight = threading.Event()
+        release = threading.Event()
+
+        def request(method, url, headers, timeout):
+            response = mock.create_autospec(requests.Response, instance=True)
+            response.status_code = requests.codes.ok
+            response.headers = {"SID": f"uuid:{url}", "TIMEOUT": "Second-300"}
+            if method == "SUBSCRIBE":
+                in_flight.set()
+                assert release.wait(5)
+            return response
+
+        mock_request.side_effect = request
+        subscription_registry.register(device)
+        assert in_flight.wait(5)
+        subscriptions = subscription_registry._subscriptions[device]
+        subscription_registry.unregister(device)
+        release.set()
+        self._wait_for_registry(subscription_registry)
+
+        subscribed = {
+            c.kwargs["url"]
+            for c in mock_request.call_args_list
+            if c.kwargs["method"] == "SUBSCRIBE"
+        }
+        unsubscribed = [
+            c.kwargs["headers"]["SID"]
+            for c in mock_request.call_args_list
+            if c.kwargs["method"] == "UNSUBSCRIBE"
+        ]
+        assert subscribed
+        assert sorted(unsubscribed) == sorted(f"uuid:{u}" for u in subscribed)
+        for subscription in subscriptions:
+            assert subscription.subscription_id is None
+            assert subscription.expiration_time == 0.0
+        assert len(subscription_registry._sched.queue) == 0
+
     @mock.patch(
         "requests.request", side_effect=requests.exceptions.ReadTimeout
     )
@@ -459,11 +581,13 @@ class Test_SubscriptionRegistry:
             reconnect.side_effect = change_url
 
             basic.action(*basic.argument, **basic.kwargs)
+            self._wait_for_resubscribe(subscription_registry)
 
             # Fail one more time to see that the correct changed URL is used.
             basic = subscription_registry._sched.queue[-1]
             subscription_registry._sched.cancel(basic)
             basic.action(*basic.argument, **basic.kwargs)
+            self._wait_for_resubscribe(subscription_registry)
 
         mock_request.assert_called_with(
             method="SUBSCRIBE",
@@ -472,6 +596,147 @@ class Test_SubscriptionRegistry:
             timeout=10,
         )
 
+    def test_resubscribe_not_blocked_by_slow_device(self):
+        """A renewal that hangs does not delay renewals for other devices."""
+        registry = subscribe.SubscriptionRegistry(requested_port=0)
+        unblock = threading.Event()
+        slow = mock.create_autospec(subscribe.Subscription, instance=True)
+        slow.device = mock.Mock()
+        slow.maintain.side_effect = lambda: unblock.wait(5) and 300
+        fast = mock.create_autospec(subscribe.Subscription, instance=True)
+        fast.device = mock.Mock()
+        fast.maintain.return_value = 300
+        scheduled = threading.Event()
+
+        with mock.patch.object(
+            registry, "_schedule", side_effect=lambda *_: scheduled.set()
+        ) as schedule:
+            registry.start()
+            try:
+                registry._resubscribe(slow)
+                registry._resubscribe(fast)
+                assert scheduled.wait(5)
+                schedule.assert_called_once_with(225, fast)
+            finally:
+                unblock.set()
+                registry.stop()
+
+    def test_renewals_serialized_per_device(self):
+        """Renewals for one device run one at a time."""
+        registry = subscribe.SubscriptionRegistry(requested_port=0)
+        device = mock.Mock()
+        started = threading.Event()
+        unblock = threading.Event()
+        first = mock.create_autospec(subscribe.Subscription, instance=True)
+        first.device = device
+        first.maintain.side_effect = (
+            lambda: started.set() or unblock.wait(5) and 300
+        )
+        second = mock.create_autospec(subscribe.Subscription, instance=True)
+        second.device = device
+        second.maintain.return_value = 300
+        other = mock.create_autospec(subscribe.Subscription, instance=True)
+        other.device = mock.Mock()
+        other.maintain.return_value = 300
+        scheduled = threading.Event()
+
+        def schedule(_, subscription, **__):
+            if subscription is other:
+                scheduled.set()
+
+        with mock.patch.object(registry, "_schedule", side_effect=schedule):
+            registry.start()
+            try:
+                registry._resubscribe(first)
+                assert started.wait(5)
+                registry._resubscribe(second)
+                registry._resubscribe(other)
+                # Another device is renewed while the first one is busy.
+                assert scheduled.wait(5)
+                second.maintain.assert_not_called()
+            finally:
+                unblock.set()
+                registry.stop()
+
+        second.maintain.assert_called_once_with()
+
+    def test_unregister_does_not_block_event_thread(self):
+        """A cancel that waits on a slow renewal runs off the event thread."""
+        registry = subscribe.SubscriptionRegistry(requested_port=0)
+        device = mock.Mock()
+        started = threading.Event()
+        unblock = threading.Event()
+        renewal = mock.create_autospec(subscribe.Subscription, instance=True)
+        renewal.device = device
+        renewal.maintain.side_effect = (
+            lambda: started.set() or unblock.wait(5) and 300
+        )
+        subscription = mock.create_autospec(
+            subscribe.Subscription, instance=True
+        )
+        subscription.device = device
+        subscription.path = "/sub/basicevent/path"
+        subscription.scheduler_event = None
+        subscription.scheduler_active = True
+        registry._subscriptions[device] = [subscription]
+        registry._subscription_paths[subscription.path] = subscription
+        ran = threading.Event()
+
+        with mock.patch.object(registry, "_schedule"):
+            registry.start()
+            try:
+                registry._resubscribe(renewal)
+                assert started.wait(5)
+                registry.unregister(device)
+                with registry._event_thread_cond:
+                    registry._sched.enter(0, 1, ran.set)
+                    registry._event_thread_cond.notify()
+                assert ran.wait(5)
+                subscription.cancel.assert_not_called()
+            finally:
+                unblock.set()
+                registry.stop()
+
+        subscription.cancel.assert_called_once_with()
+
+    def test_stop_skips_queued_renewals(self):
+        """stop() waits for running renewals but drops the queued ones."""
+        registry = subscribe.SubscriptionRegistry(requested_port=0)
+        started = threading.Event()
+        unblock = threading.Event()
+        running = mock.create_autospec(subscribe.Subscription, instance=True)
+        running.maintain.side_effect = (
+            lambda: started.set() or unblock.wait(5) and 300
+        )
+        running.device = mock.Mock()
+        running.scheduler_active = False
+        queued = mock.create_autospec(subscribe.Subscription, instance=True)
+        queued.device = mock.Mock()
+        queued.maintain.return_value = 300
+        queued.scheduler_active = False
+
+        with mock.patch("pywemo.subscribe.MAX_RESUBSCRIBE_WORKERS", 1):
+            registry.start()
+        registry._resubscribe(running)
+        assert started.wait(5)
+        registry._resubscribe(queued)
+        stopper = threading.Thread(target=registry.stop)
+        stopper.start()
+        try:
+            # Wait for stop() to take the pool, then for it to block on the
+            # running renewal.
+            while registry._resubscribe_pool is not None:
+                time.sleep(0.01)
+            stopper.join(0.1)
+            assert stopper.is_alive()
+        finally:
+            unblock.set()
+            stopper.join(5)
+
+        assert not stopper.is_alive()
+        running.maintain.assert_called_once_with()
+        queued.maintain.assert_not_called()
+
     def test_start_stop(self):
         registry = subscribe.SubscriptionRegistry(requested_port=0)
         registry.start()